@@ -7,122 +7,411 @@ without any third‑party packing library.
 """
 
 import argparse
+import hashlib
 import io
 import math
+import os
 import shutil
 import subprocess
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import numpy as np
 from PIL import Image
 
+try:
+    from numba import njit          # optional – JIT for the packing loops
+except ImportError:
+    njit = None
+
+try:
+    import oxipng as pyoxipng       # optional – in-process oxipng (pyoxipng)
+except ImportError:
+    pyoxipng = None
+
 # --------------------------------------------------------------------- #
 # Configuration – feel free to tweak
 # --------------------------------------------------------------------- #
 SRC_DIR = Path("./images")          # folder that contains PNGs
 OUT_DIR = Path("./dist")            # folder for sprite.png, sprite@2x.png, sprite.css
 RETINA_FACTOR = 2                   # 2× high‑res sprite
+PALETTE_SAMPLE = 4096               # pixels sampled to estimate colour count
+PALETTE_SKIP_COLORS = 3072          # …skip palette if the sample has more
+PALETTE_SKIP_AREA = 512 * 512       # …but only for sprites at least this big
+COHORT_MIN_ICONS = 32               # grid-pack sets of at least this many
+COHORT_MAX_SIZES = 3                # …icons when this few sizes…
+COHORT_MIN_COVERAGE = 0.9           # …cover at least this share of them
+COHORT_WIDTHS = (0.8, 0.9, 1, 1.1, 1.25)    # grid bin widths tried, × sqrt(area)
 
 # --------------------------------------------------------------------- #
-# Helper: load all PNGs (name, image, width, height)
+# Helper: load all PNGs (name, pixels, width, height)
+# pixels is the RGBA data as an (h, w, 4) uint8 array
+# Byte-identical files are only decoded (and later packed) once: returns
+# (imgs, aliases) where aliases maps the name kept in imgs to the names of
+# its duplicates
 # --------------------------------------------------------------------- #
 def load_images(src: Path):
     imgs = []
+    aliases = {}
+    seen = {}                           # content digest -> name in imgs
     for p in sorted(src.glob("*.png")):
-        im = Image.open(p).convert("RGBA")
-        imgs.append((p.stem, im, im.width, im.height))
-    return imgs
+        data = p.read_bytes()
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        if digest in seen:
+            aliases.setdefault(seen[digest], []).append(p.stem)
+            continue
+        seen[digest] = p.stem
+
+        im = Image.open(io.BytesIO(data))
+        if im.mode != "RGBA":
+            im = im.convert("RGBA")     # palette+tRNS, RGB, LA, ...
+        else:
+            im.load()                   # already RGBA – decode, no copy
+        imgs.append((p.stem, np.asarray(im), im.width, im.height))
+    return imgs, aliases
 
 
 # --------------------------------------------------------------------- #
 # -----  Simple MaxRects bin packing ----------------------------------
 # --------------------------------------------------------------------- #
+_INT64_MAX = np.iinfo(np.int64).max   # "nothing fits yet" score
+
+
+# Native kernels for the MaxRects inner loops. They work in place on the
+# int32 free-rect buffers, of which only the first *n* slots are live, and
+# are compiled with Numba when it is installed (see MaxRectsBin for the
+# NumPy fallback).
+def _maxrects_place(fx, fy, fw, fh, n, w, h):
+    """Best-area-fit search. Returns (index, score); index is -1 if no fit."""
+    best = -1
+    best_score = _INT64_MAX
+    need = np.int64(w) * h
+    for i in range(n):
+        if fw[i] >= w and fh[i] >= h:
+            score = np.int64(fw[i]) * fh[i] - need
+            if score < best_score:
+                best_score = score
+                best = i
+                if score == 0:
+                    break           # perfect fit, can't do better
+    return best, best_score
+
+
+def _maxrects_split(fx, fy, fw, fh, n, ux, uy, uw, uh):
+    """Split every free rect overlapping *used* into up to 4 parts.
+
+    Rects that don't overlap are compacted to the front, the new parts are
+    appended after them. The buffers must have room for 4*n rects.
+    Returns (n_old, n) – the survivors end at n_old, the parts at n.
+    """
+    ur, ub = ux + uw, uy + uh
+    hx = np.empty(n, np.int32)
+    hy = np.empty(n, np.int32)
+    hw = np.empty(n, np.int32)
+    hh = np.empty(n, np.int32)
+    k = 0
+    m = 0
+    for i in range(n):
+        if (fx[i] < ur and fx[i] + fw[i] > ux and
+                fy[i] < ub and fy[i] + fh[i] > uy):
+            hx[m], hy[m], hw[m], hh[m] = fx[i], fy[i], fw[i], fh[i]
+            m += 1
+        else:
+            fx[k], fy[k], fw[k], fh[k] = fx[i], fy[i], fw[i], fh[i]
+            k += 1
+    n_old = k
+    for i in range(m):
+        x, y, w, h = hx[i], hy[i], hw[i], hh[i]
+        r, b = x + w, y + h
+        if ux > x:                  # left strip
+            fx[k], fy[k], fw[k], fh[k] = x, y, ux - x, h
+            k += 1
+        if ur < r:                  # right strip
+            fx[k], fy[k], fw[k], fh[k] = ur, y, r - ur, h
+            k += 1
+        if uy > y:                  # top strip
+            fx[k], fy[k], fw[k], fh[k] = x, y, w, uy - y
+            k += 1
+        if ub < b:                  # bottom strip
+            fx[k], fy[k], fw[k], fh[k] = x, ub, w, b - ub
+            k += 1
+    return n_old, k
+
+
+def _maxrects_prune(fx, fy, fw, fh, n, n_old):
+    """Drop the new rects (index >= n_old) contained in any other rect.
+
+    Of a set of identical rects only the first one is kept. Compacts the
+    buffers in place and returns the new count.
+    """
+    keep = np.ones(n, np.bool_)
+    for i in range(n_old, n):
+        ax, ay = fx[i], fy[i]
+        ar, ab = ax + fw[i], ay + fh[i]
+        for j in range(n):
+            if j == i:
+                continue
+            if (ax >= fx[j] and ay >= fy[j] and
+                    ar <= fx[j] + fw[j] and ab <= fy[j] + fh[j]):
+                if j < i or not (ax == fx[j] and ay == fy[j] and
+                                 ar == fx[j] + fw[j] and ab == fy[j] + fh[j]):
+                    keep[i] = False
+                    break
+    k = n_old
+    for i in range(n_old, n):
+        if keep[i]:
+            fx[k], fy[k], fw[k], fh[k] = fx[i], fy[i], fw[i], fh[i]
+            k += 1
+    return k
+
+
+if njit is not None:
+    _maxrects_place = njit(cache=True)(_maxrects_place)
+    _maxrects_split = njit(cache=True)(_maxrects_split)
+    _maxrects_prune = njit(cache=True)(_maxrects_prune)
+
+
 class MaxRectsBin:
-    """MaxRects bin packing (Best Area Fit) – handles overlapping free rects."""
-    def __init__(self, width: int, height: int):
+    """MaxRects bin packing (Best Area Fit) – handles overlapping free rects.
+
+    Free rectangles are kept as four parallel int32 buffers (``fx``, ``fy``,
+    ``fw``, ``fh``), of which the first ``n`` slots are live. With Numba
+    installed the inner loops run as compiled kernels; otherwise scoring,
+    splitting and pruning run as NumPy expressions over all rects at once.
+    ``native`` selects the path for all bins.
+    """
+    native = njit is not None
+
+    def __init__(self, width: int, height: int, capacity: int = 64):
         self.width = width
         self.height = height
-        # a free rectangle is (x, y, w, h)
-        self.free_rects = [(0, 0, width, height)]
+        capacity = max(capacity, 4)
+        self.fx = np.zeros(capacity, dtype=np.int32)
+        self.fy = np.zeros(capacity, dtype=np.int32)
+        self.fw = np.zeros(capacity, dtype=np.int32)
+        self.fh = np.zeros(capacity, dtype=np.int32)
+        self.fw[0], self.fh[0] = width, height
+        self.n = 1
+
+    @property
+    def free_rects(self):
+        """Free rectangles as a list of (x, y, w, h) tuples."""
+        n = self.n
+        return list(zip(self.fx[:n].tolist(), self.fy[:n].tolist(),
+                        self.fw[:n].tolist(), self.fh[:n].tolist()))
+
+    def _reserve(self, size):
+        """Grow the buffers (at least doubling) to hold *size* rects."""
+        cap = len(self.fx)
+        if size <= cap:
+            return
+        cap = max(size, 2 * cap)
+        for name in ("fx", "fy", "fw", "fh"):
+            buf = np.zeros(cap, dtype=np.int32)
+            buf[:self.n] = getattr(self, name)[:self.n]
+            setattr(self, name, buf)
 
     def place(self, w: int, h: int):
         """Place a rectangle of size (w, h). Returns (x, y) or None."""
-        best_rect = None
-        best_score = None
-
-        for fr in self.free_rects:
-            fw, fh = fr[2], fr[3]
-            if w <= fw and h <= fh:
-                score = fw * fh - w * h  # minimal waste
-                if best_score is None or score < best_score:
-                    best_score = score
-                    best_rect = fr
-
-        if best_rect is None:
+        best = self.best_fit(w, h)
+        if best < 0:
             return None
 
-        x, y = best_rect[0], best_rect[1]
-        placed = (x, y, w, h)
-
-        # Split *every* free rect that overlaps with the placed rect
-        new_free = []
-        for fr in self.free_rects:
-            if self._overlaps(fr, placed):
-                new_free.extend(self._split(fr, placed))
-            else:
-                new_free.append(fr)
-        self.free_rects = new_free
-        self._prune()
-
+        x, y = int(self.fx[best]), int(self.fy[best])
+        self.occupy(x, y, w, h)
         return (x, y)
 
-    @staticmethod
-    def _overlaps(a, b):
-        """Check if two (x, y, w, h) rectangles overlap."""
-        return (a[0] < b[0] + b[2] and a[0] + a[2] > b[0] and
-                a[1] < b[1] + b[3] and a[1] + a[3] > b[1])
+    def best_fit(self, w: int, h: int):
+        """Index of the free rect a (w, h) rectangle fits best, or -1."""
+        n = self.n
+        if self.native:
+            best, _ = _maxrects_place(self.fx, self.fy, self.fw, self.fh, n, w, h)
+            return best
+
+        fw, fh = self.fw[:n], self.fh[:n]
+        # Minimal waste (area - w*h) is the smallest area among the rects
+        # that fit, so only those candidates are scored; int64 so large
+        # bins can't overflow the product
+        cand = np.flatnonzero((fw >= w) & (fh >= h))
+        if not len(cand):
+            return -1
+        return int(cand[(fw[cand].astype(np.int64) * fh[cand]).argmin()])
+
+    def occupy(self, x: int, y: int, w: int, h: int):
+        """Mark the (x, y, w, h) rectangle as used.
+
+        Splits *every* free rect that overlaps it, then prunes. place() ends
+        with this; callers can also use it to reserve space up front.
+        """
+        if self.native:
+            self._reserve(4 * self.n)
+            n_old, n = _maxrects_split(self.fx, self.fy, self.fw, self.fh,
+                                       self.n, x, y, w, h)
+            if n > n_old:
+                n = _maxrects_prune(self.fx, self.fy, self.fw, self.fh, n, n_old)
+            self.n = n
+            return
+
+        n = self.n
+        fx, fy, fw, fh = self.fx[:n], self.fy[:n], self.fw[:n], self.fh[:n]
+
+        # the overlap test is inlined as one mask expression over all rects
+        hit = ((fx < x + w) & (fx + fw > x) &
+               (fy < y + h) & (fy + fh > y))
+        nx, ny, nw, nh = self._split(fx[hit], fy[hit], fw[hit], fh[hit],
+                                     x, y, w, h)
+        keep = ~hit
+        n_old = int(keep.sum())
+        new_n = n_old + len(nx)
+        parts = [np.concatenate(a) for a in
+                 ((fx[keep], nx), (fy[keep], ny), (fw[keep], nw), (fh[keep], nh))]
+        self._reserve(new_n)
+        self.fx[:new_n], self.fy[:new_n], self.fw[:new_n], self.fh[:new_n] = parts
+        self.n = new_n
+        # Every new rect is checked, even a lone one – it may sit inside an
+        # existing free rect, and _prune relies on no survivor doing so.
+        if len(nx):
+            self._prune(n_old)
 
     @staticmethod
-    def _split(free, used):
-        """Split *free* into up to 4 parts that don't overlap *used*."""
-        fx, fy, fw, fh = free
-        ux, uy, uw, uh = used
-        parts = []
-        # Left strip
-        if ux > fx:
-            parts.append((fx, fy, ux - fx, fh))
-        # Right strip
-        if ux + uw < fx + fw:
-            parts.append((ux + uw, fy, (fx + fw) - (ux + uw), fh))
-        # Top strip
-        if uy > fy:
-            parts.append((fx, fy, fw, uy - fy))
-        # Bottom strip
-        if uy + uh < fy + fh:
-            parts.append((fx, uy + uh, fw, (fy + fh) - (uy + uh)))
-        return parts
-
-    def _prune(self):
-        """Remove any free rect fully contained inside another."""
-        pruned = []
-        for i, a in enumerate(self.free_rects):
-            contained = False
-            for j, b in enumerate(self.free_rects):
-                if i == j:
-                    continue
-                if (a[0] >= b[0] and a[1] >= b[1] and
-                    a[0] + a[2] <= b[0] + b[2] and
-                    a[1] + a[3] <= b[1] + b[3]):
-                    contained = True
-                    break
-            if not contained:
-                pruned.append(a)
-        self.free_rects = pruned
+    def _split(fx, fy, fw, fh, ux, uy, uw, uh):
+        """Split each free rect into up to 4 parts that don't overlap *used*.
+
+        Returns the parts as four arrays (x, y, w, h).
+        """
+        fr, fb = fx + fw, fy + fh
+        ur, ub = ux + uw, uy + uh
+        left = ux > fx
+        right = ur < fr
+        top = uy > fy
+        bottom = ub < fb
+        return (
+            np.concatenate((fx[left], np.full(right.sum(), ur, np.int32),
+                            fx[top], fx[bottom])),
+            np.concatenate((fy[left], fy[right],
+                            fy[top], np.full(bottom.sum(), ub, np.int32))),
+            np.concatenate((ux - fx[left], fr[right] - ur,
+                            fw[top], fw[bottom])),
+            np.concatenate((fh[left], fh[right],
+                            uy - fy[top], fb[bottom] - ub)),
+        )
+
+    def _prune(self, n_old):
+        """Remove any free rect fully contained inside another.
+
+        Only rects from index *n_old* on are new since the last prune. An
+        older survivor can't sit inside a new rect (every new rect is carved
+        out of a rect that was itself not dominated – occupy() prunes after
+        every split that adds rects), so only the new rows are tested –
+        against every rect, in one broadcast comparison.
+        """
+        n = self.n
+        fx, fy, fw, fh = self.fx[:n], self.fy[:n], self.fw[:n], self.fh[:n]
+        fr, fb = fx + fw, fy + fh
+        nx, ny = fx[n_old:, None], fy[n_old:, None]
+        nr, nb = fr[n_old:, None], fb[n_old:, None]
+
+        inside = (nx >= fx) & (ny >= fy) & (nr <= fr) & (nb <= fb)
+        # every rect contains itself and its duplicates; of a set of
+        # identical rects only the first one survives
+        same = (nx == fx) & (ny == fy) & (nr == fr) & (nb == fb)
+        rows = np.arange(n_old, n)[:, None]
+        cols = np.arange(n)
+        inside &= ~same | (cols < rows)
+
+        keep = ~inside.any(axis=1)
+        new_n = n_old + int(keep.sum())
+        for buf in (self.fx, self.fy, self.fw, self.fh):
+            buf[n_old:new_n] = buf[n_old:n][keep]
+        self.n = new_n
+
+
+# --------------------------------------------------------------------- #
+# Same-size cohorts – grid layout for sizes shared by many icons
+# --------------------------------------------------------------------- #
+def _size_cohorts(imgs):
+    """Sizes common enough to lay out on a plain grid, or [] if not worth it.
+
+    UI icon sets tend to come in a few fixed sizes (16/24/32 px …). When at
+    most COHORT_MAX_SIZES distinct (w, h) pairs, each shared by 2+ icons,
+    cover COHORT_MIN_COVERAGE of a set of COHORT_MIN_ICONS or more, returns
+    those sizes – largest first – so the cohorts can be packed as grids and
+    MaxRects is only needed per icon for the long tail.
+    """
+    if len(imgs) < COHORT_MIN_ICONS:
+        return []
+    counts = Counter((w, h) for _, _, w, h in imgs)
+    sizes = [size for size, c in counts.most_common(COHORT_MAX_SIZES) if c > 1]
+    if sum(counts[size] for size in sizes) < COHORT_MIN_COVERAGE * len(imgs):
+        return []
+    return sorted(sizes, key=lambda wh: max(wh), reverse=True)
+
+
+def _place_cohort(bin, size, count, xs, ys, start):
+    """Lay out *count* icons of one *size* as grids in *bin*'s free space.
+
+    Guillotine-style: the free rect that fits one icon best is filled with
+    a grid of as many icons as it holds (the last row may be partial), and
+    the grid is reserved as a block – at most two MaxRects updates per
+    grid instead of one per icon. Coordinates are written to *xs*/*ys*
+    from index *start* on. Returns False if the bin ran out of room.
+    """
+    cw, ch = size
+    i = start
+    left = count
+    while left:
+        best = bin.best_fit(cw, ch)
+        if best < 0:
+            return False
+        fx, fy = int(bin.fx[best]), int(bin.fy[best])
+        cols = min(int(bin.fw[best]) // cw, left)
+        rows = min(int(bin.fh[best]) // ch, -(-left // cols))
+        placed = min(cols * rows, left)
+        k = np.arange(placed)
+        xs[i:i + placed] = fx + (k % cols) * cw
+        ys[i:i + placed] = fy + (k // cols) * ch
+        full, rem = divmod(placed, cols)
+        if full:
+            bin.occupy(fx, fy, cols * cw, full * ch)
+        if rem:
+            bin.occupy(fx, fy + full * ch, rem * cw, ch)
+        i += placed
+        left -= placed
+    return True
+
+
+def _pack_layout(width, height, tail, cohorts, by_size, xs, ys):
+    """Pack the *tail* icons and the *cohorts* grids into one bin.
+
+    Tail icons at least as big as a cohort are placed before it, one by one;
+    each cohort is then laid out with _place_cohort(). Coordinates go to
+    *xs*/*ys* – tail first, then the cohorts in order. Returns False if the
+    *width*×*height* bin ran out of room.
+    """
+    bin = MaxRectsBin(width, height, capacity=4 * len(xs))
+    j = 0                   # next tail icon
+    start = len(tail)       # next cohort slot in xs / ys
+    for size in cohorts + [(0, 0)]:    # (0, 0): the rest of the tail
+        while j < len(tail) and max(tail[j][2], tail[j][3]) >= max(size):
+            pos = bin.place(tail[j][2], tail[j][3])
+            if pos is None:
+                return False
+            xs[j], ys[j] = pos
+            j += 1
+        if size == (0, 0):
+            break
+        if not _place_cohort(bin, size, len(by_size[size]), xs, ys, start):
+            return False
+        start += len(by_size[size])
+    return True
 
 
 # --------------------------------------------------------------------- #
 # Pack all icons into the tightest possible bin.
-# Returns (packed_list, final_width, final_height)
-# packed_list contains (name, image, x, y, w, h)
+# Returns (packed, final_width, final_height)
+# packed holds parallel columns (names, images, xs, ys, ws, hs); the
+# coordinates are int32 arrays
 # --------------------------------------------------------------------- #
 def pack_rectangles(imgs):
     total_area = sum(w * h for _, _, w, h in imgs)
@@ -134,62 +423,136 @@ def pack_rectangles(imgs):
     width = max(side, max_img_w)
     height = max(side, max_img_h)
 
-    # Sort by largest side first – a common heuristic
-    sorted_imgs = sorted(imgs, key=lambda t: max(t[2], t[3]), reverse=True)
-
-    while True:
-        bin = MaxRectsBin(width, height)
-        placed = []
-        success = True
+    # Sort by largest side first – a common heuristic. Icons in a same-size
+    # cohort are kept apart and laid out as one grid each, in the same
+    # largest-first order as the rest (the "tail").
+    cohorts = _size_cohorts(imgs)
+    by_size = {size: [t for t in imgs if (t[2], t[3]) == size] for size in cohorts}
+    tail = sorted((t for t in imgs if (t[2], t[3]) not in by_size),
+                  key=lambda t: max(t[2], t[3]), reverse=True)
+    sorted_imgs = tail + [t for size in cohorts for t in by_size[size]]
+    n = len(sorted_imgs)
+    ws = np.array([t[2] for t in sorted_imgs], dtype=np.int32)
+    hs = np.array([t[3] for t in sorted_imgs], dtype=np.int32)
+    xs = np.zeros(n, dtype=np.int32)
+    ys = np.zeros(n, dtype=np.int32)
+
+    if cohorts:
+        # Grids leave slack at the bin edges that depends on the bin width,
+        # so – like the browser tool – try a few widths and keep the layout
+        # with the smallest bounding box. For each width the height starts
+        # at total area / width and grows in small steps until all fits;
+        # doubling would leave half the bin empty.
+        best_area = None
+        for factor in COHORT_WIDTHS:
+            try_w = max(math.ceil(side * factor), max_img_w)
+            try_h = max(-(-total_area // try_w), max_img_h)
+            while not _pack_layout(try_w, try_h, tail, cohorts, by_size, xs, ys):
+                try_h += max(1, try_h // 32)
+            area = int((xs + ws).max()) * int((ys + hs).max())
+            if best_area is None or area < best_area:
+                best_area, best_xs, best_ys = area, xs.copy(), ys.copy()
+        xs, ys = best_xs, best_ys
+    else:
+        # If it failed, enlarge the bin and try again
+        while not _pack_layout(width, height, tail, cohorts, by_size, xs, ys):
+            if width <= height:
+                width *= 2
+            else:
+                height *= 2
 
-        for name, im, w, h in sorted_imgs:
-            pos = bin.place(w, h)
-            if pos is None:
-                success = False
-                break
-            placed.append((name, im, pos[0], pos[1], w, h))
+    names = [t[0] for t in sorted_imgs]
+    images = [t[1] for t in sorted_imgs]
+    final_w = int((xs + ws).max())
+    final_h = int((ys + hs).max())
 
-        if success:
-            break
+    return (names, images, xs, ys, ws, hs), final_w, final_h
 
-        # If it failed, enlarge the bin and try again
-        if width <= height:
-            width *= 2
-        else:
-            height *= 2
 
-    # placed = (name, im, x, y, w, h)
-    final_w = max(p[2] + p[4] for p in placed)   # x + w
-    final_h = max(p[3] + p[5] for p in placed)   # y + h
+# --------------------------------------------------------------------- #
+# Self-check: the Numba kernels and the NumPy path must pack identically
+# --------------------------------------------------------------------- #
+def check_packers(imgs):
+    """Pack *imgs* once with each MaxRects implementation and compare.
 
-    return placed, final_w, final_h
+    Returns a list of problems – empty when both layouts are identical and
+    no two icons overlap. Needs numba installed.
+    """
+    layouts = []
+    try:
+        for native in (True, False):
+            MaxRectsBin.native = native
+            layouts.append(pack_rectangles(imgs))
+    finally:
+        MaxRectsBin.native = njit is not None
+
+    (numba_cols, *numba_size), (numpy_cols, *numpy_size) = layouts
+    problems = []
+    if (numba_size != numpy_size or numba_cols[0] != numpy_cols[0]
+            or not all(np.array_equal(a, b) for a, b in zip(numba_cols[2:], numpy_cols[2:]))):
+        problems.append("Numba and NumPy layouts differ")
+
+    for label, ((_, _, xs, ys, ws, hs), sprite_w, sprite_h) in zip(("Numba", "NumPy"), layouts):
+        # count how many icons cover each pixel
+        cover = np.zeros((sprite_h, sprite_w), dtype=np.uint16)
+        for x, y, w, h in zip(xs.tolist(), ys.tolist(), ws.tolist(), hs.tolist()):
+            cover[y:y + h, x:x + w] += 1
+        if cover.max() > 1:
+            problems.append(f"{label} layout has overlapping icons")
+    return problems
 
 
 # --------------------------------------------------------------------- #
 # Create a sprite from the packed layout
 # --------------------------------------------------------------------- #
-def make_sprite(packed_imgs, sprite_w, sprite_h, upscale=1, bg=(0, 0, 0, 0)):
-    out_w, out_h = sprite_w * upscale, sprite_h * upscale
-    sprite = Image.new("RGBA", (out_w, out_h), bg)
+def _upscale(arr, factor):
+    """Integer nearest-neighbour upscale – each pixel becomes a factor² block.
+
+    Same result as ``Image.resize(..., Image.NEAREST)``, but done as two
+    ``np.repeat`` copies instead of going through Pillow's resampler.
+    """
+    return arr.repeat(factor, axis=0).repeat(factor, axis=1)
 
-    # List of (name, x, y) for CSS – negative values for background‑position
-    positions = []
 
-    for name, im, x, y, w, h in packed_imgs:
+def _render(packed, sprite_w, sprite_h, upscale):
+    """Paste the packed icons into a new, fully transparent (h, w, 4) buffer."""
+    _, images, xs, ys, _, _ = packed
+    out_w, out_h = sprite_w * upscale, sprite_h * upscale
+    sprite = np.zeros((out_h, out_w, 4), dtype=np.uint8)
+
+    # Icons never overlap and the background is fully transparent, so each
+    # one is a straight block copy – compositing would change nothing.
+    # Upscaling an icon takes microseconds, less than handing it to a
+    # thread pool would, so it is done right here.
+    for arr, x, y in zip(images, (xs * upscale).tolist(), (ys * upscale).tolist()):
         if upscale > 1:
-            im = im.resize((w * upscale, h * upscale), Image.NEAREST)
+            arr = _upscale(arr, upscale)
+        h, w = arr.shape[:2]
+        sprite[y:y + h, x:x + w] = arr
 
-        sprite.paste(im, (x * upscale, y * upscale), im)
-        positions.append((name, -x, -y))
+    return sprite
 
-    return sprite, positions
+
+def _positions(packed):
+    """List of (name, x, y) for CSS – negative values for background‑position."""
+    names, _, xs, ys, _, _ = packed
+    return list(zip(names, (-xs).tolist(), (-ys).tolist()))
+
+
+def make_sprite(packed, sprite_w, sprite_h, upscale=1):
+    """Render the packed icons as an RGBA image, *upscale*× the layout size.
+
+    The image wraps the rendered buffer without copying it.
+    """
+    return Image.fromarray(_render(packed, sprite_w, sprite_h, upscale))
 
 
 # --------------------------------------------------------------------- #
 # Generate the CSS file
 # --------------------------------------------------------------------- #
 def generate_css(positions, sprite_w, sprite_h, max_w, max_h,
-                  normal_name, retina_name):
+                  normal_name, retina_name, aliases=None):
+    aliases = aliases or {}
     css = []
 
     css.append(".sprite {")
@@ -206,7 +569,9 @@ def generate_css(positions, sprite_w, sprite_h, max_w, max_h,
     css.append("}\n")
 
     for name, x, y in positions:
-        css.append(f".icon-{name} {{")
+        # duplicates share their original's rule
+        selectors = ", ".join(f".icon-{n}" for n in [name, *aliases.get(name, ())])
+        css.append(f"{selectors} {{")
         css.append(f"  background-position: {x}px {y}px;")
         css.append("}\n")
 
@@ -223,21 +588,89 @@ def _uses_alpha(img):
     return img.getchannel("A").getextrema()[0] < 255
 
 
-def _png_bytes(img):
-    """Render *img* to an in-memory PNG with max Pillow compression."""
+def _png_bytes(img, for_decision_only=False):
+    """Render *img* to an in-memory PNG with max Pillow compression.
+
+    With *for_decision_only* a plain zlib level 6 encode is used instead –
+    good enough to compare candidates when a lossless crusher re-encodes
+    the winner anyway, and several times faster than ``optimize=True``.
+    """
     buf = io.BytesIO()
-    img.save(buf, format="PNG", optimize=True)
+    if for_decision_only:
+        img.save(buf, format="PNG", compress_level=6)
+    else:
+        img.save(buf, format="PNG", optimize=True)
     return buf.getvalue()
 
 
-def _try_external_crush(path):
+def _palette_worth_trying(img):
+    """Cheap guess whether a 256-colour palette could be competitive.
+
+    Counts distinct colours in a fixed random sample of pixels. When nearly
+    every sampled pixel is a different colour the sprite is photographic:
+    256 colours would badly posterise it, so quantising (one of Pillow's
+    slowest operations) is skipped for large sprites and truecolour wins.
+    """
+    if img.width * img.height < PALETTE_SKIP_AREA:
+        return True
+    rng = np.random.default_rng(0)      # fixed seed – reproducible builds
+    # read the sampled pixels straight from Pillow's buffer – converting the
+    # whole sprite to an array would copy all of it for a few thousand pixels
+    px, w = img.load(), img.width
+    sample = np.array([px[i % w, i // w] for i in
+                       rng.integers(0, w * img.height, PALETTE_SAMPLE).tolist()])
+    return len(np.unique(sample, axis=0)) <= PALETTE_SKIP_COLORS
+
+
+def _palette_png_bytes(img, for_decision_only=False):
+    """Render *img* as an indexed PNG, or return None if quantize fails."""
+    try:
+        # lossless for ≤ 256 unique colours, lossy otherwise (no dither
+        # for crisp edges)
+        return _png_bytes(img.quantize(colors=256, dither=0), for_decision_only)
+    except Exception:
+        return None  # quantize can fail on some edge-case images
+
+
+def _oxipng_options(zopfli=False):
+    """pyoxipng keyword arguments matching the oxipng CLI call below."""
+    opts = dict(level=4, strip=pyoxipng.StripChunks.safe(), optimize_alpha=True)
+    if zopfli:
+        opts["deflate"] = pyoxipng.Deflaters.zopfli(15)
+    return opts
+
+
+def _oxipng_bytes(data, zopfli=False):
+    """Losslessly re-encode PNG *data* in-process with pyoxipng.
+
+    Like the CLI crushers this is optional: on failure *data* is returned
+    unchanged.
+    """
+    try:
+        return pyoxipng.optimize_from_memory(data, **_oxipng_options(zopfli))
+    except pyoxipng.PngError:
+        return data
+
+
+def _have_lossless_crusher():
+    """True if oxipng (module or CLI) or optipng will re-encode the output."""
+    return (pyoxipng is not None or shutil.which("oxipng") is not None
+            or shutil.which("optipng") is not None)
+
+
+def _try_external_crush(path, oxipng_done=False, zopfli=False):
     """Optionally re-compress with external tools if available.
 
     Tried in order:
       1. pngquant  – lossy palette (quality ≥ 90, skipped if quality drops)
-      2. oxipng    – lossless re-encode   (preferred)
+      2. oxipng    – lossless re-encode   (preferred; in-process via
+                     pyoxipng when installed, else the CLI)
       3. optipng   – lossless re-encode   (fallback)
     Each tool only overwrites the file if the result is smaller.
+
+    *oxipng_done* means the file was already run through pyoxipng before it
+    was written, so step 2 only has to redo it when pngquant replaced it.
+    *zopfli* makes oxipng use the much slower Zopfli deflater.
     """
     # --- lossy quantisation (high quality, keeps only if smaller) ---
     pngquant = shutil.which("pngquant")
@@ -251,16 +684,26 @@ def _try_external_crush(path):
         tmp_p = Path(tmp)
         if res.returncode == 0 and tmp_p.exists() and tmp_p.stat().st_size < path.stat().st_size:
             tmp_p.replace(path)
+            oxipng_done = False
         else:
             tmp_p.unlink(missing_ok=True)
 
     # --- lossless re-compression ---
+    if pyoxipng is not None:
+        if not oxipng_done:
+            try:
+                pyoxipng.optimize(str(path), **_oxipng_options(zopfli))
+            except pyoxipng.PngError:
+                pass  # keep the file as it is, like a failed CLI run
+        return
+
     oxipng = shutil.which("oxipng")
     if oxipng:
-        subprocess.run(
-            [oxipng, "-o", "4", "--strip", "safe", "-q", str(path)],
-            capture_output=True,
-        )
+        args = [oxipng, "-o", "4", "-t", str(os.cpu_count() or 1),
+                "--strip", "safe", "-a", "-q"]
+        if zopfli:
+            args.append("--zopfli")
+        subprocess.run(args + [str(path)], capture_output=True)
         return
 
     optipng = shutil.which("optipng")
@@ -271,46 +714,49 @@ def _try_external_crush(path):
         )
 
 
-def optimize_and_save(img, path):
+def optimize_and_save(img, path, zopfli=False):
     """Save *img* as the smallest possible PNG.
 
     Strategy:
       1. Drop the alpha channel entirely when it is unused.
-      2. Try true-colour (RGB / RGBA) with max zlib compression.
+      2. Try true-colour (RGB / RGBA) with max zlib compression – or a
+         quick encode when a lossless crusher will redo it in step 5.
       3. Try palette (indexed) mode – lossless when ≤ 256 unique colours,
-         lossy 256-colour quantisation otherwise.
+         lossy 256-colour quantisation otherwise; skipped for large
+         sprites with far too many colours for a palette.
       4. Write whichever is smallest.
-      5. Optionally re-crush with pngquant / oxipng / optipng.
+      5. Optionally re-crush with pngquant / oxipng / optipng
+         (*zopfli* selects oxipng's slowest, smallest deflater).
     """
     has_alpha = _uses_alpha(img)
     base = img if has_alpha else img.convert("RGB")
 
-    candidates = {}
+    quick = _have_lossless_crusher()
 
-    # --- true-colour ---
-    candidates["truecolor"] = _png_bytes(base)
+    # The two encodes are independent and zlib releases the GIL,
+    # so run them side by side
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        truecolor = pool.submit(_png_bytes, base, quick)
+        palette = None
+        if _palette_worth_trying(base):
+            palette = pool.submit(_palette_png_bytes, base, quick)
 
-    # --- palette / indexed ---
-    try:
-        unique = base.getcolors(maxcolors=256)
-        if unique is not None:
-            # ≤ 256 unique colours → effectively lossless
-            pal = base.quantize(colors=256, dither=0)
-        else:
-            # > 256 colours → lossy quantisation (no dither for crisp edges)
-            pal = base.quantize(colors=256, dither=0)
-        candidates["palette"] = _png_bytes(pal)
-    except Exception:
-        pass  # quantize can fail on some edge-case images
+    candidates = {"truecolor": truecolor.result()}
+    if palette is not None and palette.result() is not None:
+        candidates["palette"] = palette.result()
 
     best_name = min(candidates, key=lambda k: len(candidates[k]))
     best_data = candidates[best_name]
 
+    # lossless crush in memory – no subprocess, no re-read of the file
+    if pyoxipng is not None:
+        best_data = _oxipng_bytes(best_data, zopfli)
+
     path = Path(path)
     path.write_bytes(best_data)
 
     # optional external crush (only overwrites if smaller)
-    _try_external_crush(path)
+    _try_external_crush(path, oxipng_done=pyoxipng is not None, zopfli=zopfli)
 
     final_size = path.stat().st_size
     return best_name, final_size
@@ -325,33 +771,56 @@ def main():
                         help="folder containing PNG icons")
     parser.add_argument("--out", type=Path, default=OUT_DIR,
                         help="output folder")
+    parser.add_argument("--zopfli", action="store_true",
+                        help="final build: let oxipng use Zopfli (much slower, "
+                             "slightly smaller)")
+    parser.add_argument("--check-packing", action="store_true",
+                        help="pack with and without numba, check that the layouts "
+                             "match and don't overlap, then exit")
     args = parser.parse_args()
+    if args.check_packing and njit is None:
+        parser.error("--check-packing needs numba installed")
 
     src = args.src
     out = args.out
     out.mkdir(parents=True, exist_ok=True)
 
-    imgs = load_images(src)
+    imgs, aliases = load_images(src)
     if not imgs:
         print(f"No PNG files found in {src}")
         return
 
-    print(f"Loaded {len(imgs)} PNGs.")
+    n_dupes = sum(len(names) for names in aliases.values())
+    print(f"Loaded {len(imgs) + n_dupes} PNGs ({n_dupes} duplicates).")
+
+    if args.check_packing:
+        problems = check_packers(imgs)
+        for problem in problems:
+            print(f"Packing check failed: {problem}")
+        if problems:
+            raise SystemExit(1)
+        print("Packing check passed: Numba and NumPy layouts match, no overlaps.")
+        return
 
     # 1️⃣ Pack the icons
     packed, sprite_w, sprite_h = pack_rectangles(imgs)
     print(f"Sprite size (normal): {sprite_w}×{sprite_h} px")
 
-    # 2️⃣ Normal sprite
-    normal_sprite, positions = make_sprite(packed, sprite_w, sprite_h, upscale=1)
+    positions = _positions(packed)
+
+    # 2️⃣ Normal sprite – written and released before the retina one is
+    # rendered, so only one sprite buffer is alive at a time
+    normal_sprite = make_sprite(packed, sprite_w, sprite_h)
     normal_path = out / "sprite.png"
-    strategy, size = optimize_and_save(normal_sprite, normal_path)
+    strategy, size = optimize_and_save(normal_sprite, normal_path, args.zopfli)
+    del normal_sprite
     print(f"Saved normal sprite: {normal_path}  ({size:,} bytes, {strategy})")
 
     # 3️⃣ Retina sprite
-    retina_sprite, _ = make_sprite(packed, sprite_w, sprite_h, upscale=RETINA_FACTOR)
+    retina_sprite = make_sprite(packed, sprite_w, sprite_h, upscale=RETINA_FACTOR)
     retina_path = out / "sprite@2x.png"
-    strategy, size = optimize_and_save(retina_sprite, retina_path)
+    strategy, size = optimize_and_save(retina_sprite, retina_path, args.zopfli)
+    del retina_sprite
     print(f"Saved retina sprite: {retina_path}  ({size:,} bytes, {strategy})")
 
     # 4️⃣ CSS
@@ -367,6 +836,7 @@ def main():
         max_h,
         normal_name="sprite.png",
         retina_name="sprite@2x.png",
+        aliases=aliases,
     )
     css_path = out / "sprite.css"
     css_path.write_text(css_text, encoding="utf-8")